@@ -11,16 +11,37 @@ SPDX-License-Identifier: BSD-3-Clause
 """
 
 import argparse
-import fnmatch
+import collections
+import contextlib
+import errno
+import functools
+import hashlib
+import io
+import json
+import logging
 import os
+import pathlib
+import shutil
+import stat
 import sys
+import tempfile
+import xml.etree.ElementTree as ET
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
 
-from rdflib import Graph, plugin
-from rdflib.parser import Parser
-from rdflib.serializer import Serializer
+try:
+    import blake3
+except ImportError:
+    blake3 = None
+try:
+    import pyoxigraph as ox
+except ImportError:
+    ox = None
 
-plugin.register("rdf-json", Parser    , "rdflib_rdfjson.rdfjson_parser"    , "RdfJsonParser")
-plugin.register("rdf-json", Serializer, "rdflib_rdfjson.rdfjson_serializer", "RdfJsonSerializer")
+log = logging.getLogger("rdfconvert")
+
+# rdflib is only imported where it is actually needed,
+# so parsing the arguments (and --help) does not have to wait for it
+_PLUGINS_REGISTERED = False
 
 INPUT_FORMAT_TO_EXTENSIONS = {
     "application/rdf+xml" : [".xml", ".rdf", ".owl"],
@@ -46,6 +67,39 @@ OUTPUT_FORMAT_TO_EXTENSION = {
     "ttl"        : ".ttl",
     "n3"         : ".n3"
     }
+# line based input formats, which can be converted one statement at a time,
+# without collecting all of them in a graph first
+STREAMABLE_INPUT_FORMATS = {"nt", "nquads"}
+# output formats that can be written one statement at a time
+# (N-Triples is a subset of Turtle, so it is valid Turtle output as well)
+STREAMABLE_OUTPUT_FORMATS = {"nt", "nquads", "ttl"}
+# pairs of input and output formats, where each input file is a valid output file
+# that means the same, so it can simply be copied
+# (only formats without relative IRIs, as those would be resolved against the output location;
+# an N-Triples file is an N-Quads file that only uses the default graph)
+COPYABLE_FORMAT_PAIRS = {("nt", "nt"), ("nquads", "nquads"), ("nt", "nquads")}
+# input formats that pyoxigraph parses (a lot faster than rdflib), if it is installed,
+# mapped to the names of the pyoxigraph.RdfFormat members
+OXIGRAPH_INPUT_FORMATS = {
+    "application/rdf+xml" : "RDF_XML",
+    "xml"                 : "RDF_XML",
+    "ttl"                 : "TURTLE",
+    "nt"                  : "N_TRIPLES"
+    }
+# output formats that pyoxigraph writes directly, without going through rdflib at all
+OXIGRAPH_OUTPUT_FORMATS = {
+    "nt"     : "N_TRIPLES",
+    "nquads" : "N_QUADS"
+    }
+# how many threads read the input files ahead of the parsing processes
+PREFETCH_THREADS = 8
+# the buffer size for copying files, if the zero-copy sendfile is not available
+COPY_BUFFER_SIZE = 1 << 20
+# how many triples to collect before adding them to the graph at once
+ADD_BATCH_SIZE = 10000
+
+CACHE_DIR = os.path.join(os.environ.get("XDG_CACHE_HOME", os.path.expanduser("~/.cache")),
+                         "rdfconvert")
 
 # a function that returns the script description as a string
 def description():
@@ -68,10 +122,32 @@ def epilog():
         s += f" - {ouptut_format.ljust(10)} : '{extension}'\n"
     return s
 
+_EPILOG = epilog()
+
+def positive_int(value):
+    """
+    An argparse type for integers of at least 1
+    """
+
+    number = int(value)
+    if number < 1:
+        raise argparse.ArgumentTypeError(f"must be at least 1, got {value}")
+    return number
+
+def plain_file_name(value):
+    """
+    An argparse type for file names without any directory parts
+    """
+
+    if (value in ("", ".", "..") or os.path.basename(value) != value
+            or (os.path.altsep is not None and os.path.altsep in value)):
+        raise argparse.ArgumentTypeError(f"must be a plain file name, got '{value}'")
+    return value
+
 def parse_args():
     parser = argparse.ArgumentParser(formatter_class = argparse.RawDescriptionHelpFormatter,
                                      description     = description(),
-                                     epilog          = epilog())
+                                     epilog          = _EPILOG)
 
     parser.add_argument("INPUT",
                         metavar="INPUT",
@@ -170,7 +246,46 @@ def parse_args():
                         const=True,
                         default=False,
                         help="Do not write any output files, but just print a message for each "
-                             "file that they *would* be written without the -s flag.")
+                             "file that they *would* be written without the -s flag. "
+                             "The input files are not parsed either.")
+
+    parser.add_argument("-m", "--merge",
+                        dest="merge",
+                        action="store_true",
+                        default=False,
+                        help="Merge all input files into a single graph, and write it as a " \
+                             "single output, instead of one output per input file. When the " \
+                             "-o flag is given, it is written to the file named by " \
+                             "--merge-name (plus the output extension) in the output " \
+                             "directory, otherwise to the stdout. The input files are parsed " \
+                             "one after the other, the --jobs flag has no effect here.")
+
+    parser.add_argument("--merge-name",
+                        dest="merge_name",
+                        metavar="NAME",
+                        action="store",
+                        type=plain_file_name,
+                        default="merged",
+                        help="The file name (without extension) of the merged output file " \
+                             "in the output directory, when the --merge flag is given " \
+                             "(default: merged).")
+
+    parser.add_argument("--cache",
+                        dest="cache",
+                        action=argparse.BooleanOptionalAction,
+                        default=False,
+                        help="Cache the parsed graph of each input file as N-Triples " \
+                             f"in {CACHE_DIR}, keyed by the file content, path and input format, " \
+                             "so converting the same file again (e.g. into an other output " \
+                             "format) does not have to parse the original serialization again.")
+
+    parser.add_argument("-j", "--jobs",
+                        dest="jobs",
+                        action="store",
+                        type=positive_int,
+                        default=os.cpu_count() or 1,
+                        help="The number of files to convert in parallel, " \
+                             "each in its own process (default: the number of CPUs).")
 
     parser.add_argument("-v", "--verbose",
                         dest="verbose",
@@ -183,103 +298,683 @@ def parse_args():
 
     return args
 
-def get_output_abs_path(verbose, args, input_file_or_dir, head):
+def get_output_abs_path(args, output_dir_abs, input_file_or_dir, head):
     if args.no_tree:
-        output_abs_path = os.path.abspath(args.OUTPUTDIR)
+        output_abs_path = output_dir_abs
     else:
         # remove the common prefix from the head and the input directory
         # (otherwise the given input path will also be added to the output path)
         common_prefix = os.path.commonprefix([head, input_file_or_dir])
-        verbose(f" - input file or dir: {input_file_or_dir}")
-        verbose(f" - common prefix: {common_prefix}")
+        log.debug(" - input file or dir: %s", input_file_or_dir)
+        log.debug(" - common prefix: %s", common_prefix)
         head_without_common_prefix = head[len(common_prefix)+1:]
-        verbose(f" - head without common prefix: {head_without_common_prefix}")
-        output_abs_path = os.path.join(os.path.abspath(args.OUTPUTDIR),
-                                        head_without_common_prefix)
-        verbose(f" - output absolute path: {output_abs_path}")
+        log.debug(" - head without common prefix: %s", head_without_common_prefix)
+        output_abs_path = os.path.join(output_dir_abs, head_without_common_prefix)
+        log.debug(" - output absolute path: %s", output_abs_path)
 
     return output_abs_path
 
-def process_input_files(verbose, args, input_file_or_dir, output_extension, input_files):
+def _iter_input_files(root, extensions, recursive):
     """
-    Creates the graph, and parse the input files
+    Yields the paths of all files in the root directory that end with one of the extensions
+    (given as a tuple, so str.endswith can match all of them in one call),
+    with a single scandir pass per directory
     """
 
-    for input_file in input_files:
+    stack = [root]
+    while stack:
+        dir_name = stack.pop()
+        try:
+            entries = os.scandir(dir_name)
+        except OSError as error:
+            # like os.walk, skip sub-directories that can not be read
+            if dir_name == root:
+                raise
+            log.warning("WARNING: Skipping directory '%s': %s", dir_name, error)
+            continue
+        with entries:
+            for entry in entries:
+                if entry.is_dir(follow_symlinks=False):
+                    if recursive:
+                        stack.append(entry.path)
+                # is_file() uses the file type cached by scandir (it only stats symlinks),
+                # so skipping special files and broken links costs no extra syscalls
+                elif entry.name.endswith(extensions) and entry.is_file():
+                    yield entry.path
+
+def may_overwrite(args, output_abs_file_name):
+    """
+    If the "force" flag is not set, then ask for permission to overwrite the file
+    """
+
+    if args.force:
+        return True
+    yes_or_no = input(f"Overwrite {output_abs_file_name}? (y/n): ")
+    return yes_or_no.lower() in ["y", "yes"]
+
+def may_write(args, output_abs_file_name):
+    """
+    If the output file exists already and the "force" flag is not set,
+    then ask for permission to overwrite the file
+    """
+
+    return not os.path.exists(output_abs_file_name) or may_overwrite(args, output_abs_file_name)
 
-        g = Graph()
-        g.parse(input_file, format=args.FROM)
+def plan_output_files(args, output_dir_abs, input_file_or_dir, output_extension, input_files,
+                      jobs, planned_outputs):
+    """
+    Figures out the output file for each input file,
+    and asks for permission to overwrite existing ones.
+    Appends the (input file, output file) tuples to convert to jobs,
+    where the output file is None if the output should go to the stdout.
+    planned_outputs maps each output file planned so far to the index of its job,
+    so no two jobs ever write the same output file;
+    if a later input file overwrites the output of an earlier one,
+    the earlier job is replaced by None.
+    """
 
-        verbose(" - the graph was parsed successfully")
+    # files in the same directory share the same output path
+    output_abs_paths = {}
+    for input_file in input_files:
 
         # if no output directory is specified, just print the output to the stdout
         if args.OUTPUTDIR is None:
-            output = g.serialize(None, format=args.TO)
-            verbose(" - output:")
-            print(output)
-        # if an output directory was provided, but it doesn't exist, then exit the script
-        elif not os.path.exists(args.OUTPUTDIR):
-            sys.exit(f"ERROR: Output dir '{args.OUTPUTDIR}' was not found!")
-        # if the output directory was given and it exists, then figure out the output filename
-        # and write the output to disk
+            jobs.append((input_file, None))
+        # if the output directory was given (main made sure it exists),
+        # then figure out the output filename
         else:
             head, tail = os.path.split(input_file)
-            verbose(f" - head, tail: {head}, {tail}")
-            output_abs_path = get_output_abs_path(verbose, args, input_file_or_dir, head)
+            log.debug(" - head, tail: %s, %s", head, tail)
+            output_abs_path = output_abs_paths.get(head)
+            if output_abs_path is None:
+                output_abs_path = get_output_abs_path(args, output_dir_abs, input_file_or_dir,
+                                                      head)
+                output_abs_paths[head] = output_abs_path
             output_file_name = os.path.splitext(tail)[0] + output_extension
             output_abs_file_name = os.path.join(output_abs_path, output_file_name)
 
-            verbose(f" - output filename: '{output_abs_file_name}'")
+            log.debug(" - output filename: '%s'", output_abs_file_name)
 
             # for safety, check that we're not overwriting the input file
-            if output_abs_file_name == os.path.abspath(input_file):
+            input_abs_file_name = os.path.abspath(input_file)
+            if output_abs_file_name == input_abs_file_name:
                 sys.exit(f"ERROR: Input file '{output_abs_file_name}' is the same as output file!")
             else:
-                verbose(" - this file is different from the input filename")
-
-            # if the output file exists already and the "force" flag is not set,
-            # then ask for permission to overwrite the file
-            skip_this_file = False
-            if not args.force and os.path.exists(output_abs_file_name):
-                yes_or_no = input(f"Overwrite {output_abs_file_name}? (y/n): ")
-                if yes_or_no.lower() not in ["y", "yes"]:
-                    skip_this_file = True
-
-            if skip_this_file:
-                verbose(" - this file will be skipped")
-            else:
-                dir_name = os.path.dirname(output_abs_file_name)
-                if not os.path.exists(dir_name):
-                    if args.simulate:
-                        print(f"Simulation: this directory tree would be written: {dir_name}")
-                    else:
-                        verbose(f" - Now creating {dir_name} since it does not exist yet")
-                        os.makedirs(dir_name)
-
-                if args.simulate:
-                    print(f"Simulation: this file would be written: {output_abs_file_name}")
+                log.debug(" - this file is different from the input filename")
+
+            # (this has to happen here, as the worker processes can not prompt)
+            earlier_job_index = planned_outputs.get(output_abs_file_name)
+            if earlier_job_index is not None:
+                # an earlier input file is converted into the same output file already,
+                # which this one would overwrite, like when converting them one by one
+                if may_overwrite(args, output_abs_file_name):
+                    jobs[earlier_job_index] = None
+                else:
+                    log.debug(" - this file will be skipped")
+                    continue
+            elif not may_write(args, output_abs_file_name):
+                log.debug(" - this file will be skipped")
+                continue
+            planned_outputs[output_abs_file_name] = len(jobs)
+            jobs.append((input_file, output_abs_file_name))
+
+def create_output_dirs(args, jobs):
+    """
+    Creates all the output directories at once, before any file is converted
+    """
+
+    dir_names = {os.path.dirname(output_abs_file_name)
+                 for _, output_abs_file_name in jobs
+                 if output_abs_file_name is not None}
+    for dir_name in sorted(dir_names):
+        if not args.simulate:
+            log.debug(" - Now creating %s if it does not exist yet", dir_name)
+            os.makedirs(dir_name, exist_ok=True)
+        elif not os.path.isdir(dir_name):
+            print(f"Simulation: this directory tree would be written: {dir_name}")
+
+class _StreamSink:
+    """
+    Writes each parsed statement straight to the output,
+    instead of collecting them in a graph
+    """
+
+    def __init__(self, out, keep_graph_names):
+        from rdflib.plugins.serializers.nquads import _nq_row
+        from rdflib.plugins.serializers.nt import _nt_row
+
+        self.out = out
+        self.keep_graph_names = keep_graph_names
+        self._nq_row = _nq_row
+        self._nt_row = _nt_row
+
+    def triple(self, s, p, o):
+        self.out.write(self._nt_row((s, p, o)))
+
+    def quad(self, s, p, o, c):
+        if c is not None and self.keep_graph_names:
+            self.out.write(self._nq_row((s, p, o), c))
+        else:
+            self.triple(s, p, o)
+
+@functools.lru_cache(maxsize=None)
+def _nquads_stream_parser_class():
+    """
+    Returns the N-Quads parser class,
+    which can only be defined once rdflib was imported
+    """
+
+    from rdflib.plugins.parsers.ntriples import W3CNTriplesParser, ParseError, r_tail, r_wspace
+
+    class _NQuadsStreamParser(W3CNTriplesParser):
+        """
+        Like the N-Triples parser, but accepts an optional graph name on each line,
+        and hands the statements to the sink as quads
+        """
+
+        def parseline(self, bnode_context=None):
+            self.eat(r_wspace)
+            if (not self.line) or self.line.startswith("#"):
+                return  # The line is empty or a comment
+
+            subject = self.subject(bnode_context)
+            self.eat(r_wspace)
+            predicate = self.predicate()
+            self.eat(r_wspace)
+            obj = self.object(bnode_context)
+            self.eat(r_wspace)
+            context = self.uriref() or self.nodeid(bnode_context) or None
+            self.eat(r_tail)
+
+            if self.line:
+                raise ParseError(f"Trailing garbage: {self.line}")
+            self.sink.quad(subject, predicate, obj, context)
+
+    return _NQuadsStreamParser
+
+class _BatchSink:
+    """
+    Collects parsed statements and adds them to the graph in batches,
+    which is cheaper than adding them one by one
+    """
+
+    def __init__(self, g, batch_size=ADD_BATCH_SIZE):
+        self.g = g
+        self.batch_size = batch_size
+        self.batch = []
+
+    def triple(self, s, p, o):
+        self.batch.append((s, p, o, self.g))
+        if len(self.batch) >= self.batch_size:
+            self.flush()
+
+    def quad(self, s, p, o, c):
+        # the graph names are dropped, like when streaming into a format without them
+        self.triple(s, p, o)
+
+    def flush(self):
+        self.g.addN(self.batch)
+        self.batch.clear()
+
+def _parse_lines(input_file, input_format, sink):
+    """
+    Parses a line based input file, handing each statement to the sink as soon as it was read
+    """
+
+    from rdflib.plugins.parsers.ntriples import W3CNTriplesParser
+
+    if input_format == "nquads":
+        parser = _nquads_stream_parser_class()(sink=sink)
+    else:
+        parser = W3CNTriplesParser(sink=sink)
+    with open(input_file, encoding="utf-8") as in_stream:
+        parser.parse(in_stream)
+
+def _stream_convert(args, input_file, out):
+    """
+    Converts a line based input file one statement at a time,
+    so memory usage stays constant, regardless of the input size.
+    """
+
+    sink = _StreamSink(out, keep_graph_names=(args.TO == "nquads"))
+    _parse_lines(input_file, args.FROM, sink)
+
+def _ox_parse(input_file, input_format):
+    """
+    Returns an iterator over the quads in the input file, parsed by pyoxigraph
+    """
+
+    return ox.parse(path=input_file,
+                    format=getattr(ox.RdfFormat, OXIGRAPH_INPUT_FORMATS[input_format]),
+                    base_iri=pathlib.Path(os.path.abspath(input_file)).as_uri(),
+                    without_named_graphs=True,
+                    rename_blank_nodes=True)
+
+def _add_ox_quads(quads, sink):
+    """
+    Converts the quads parsed by pyoxigraph into rdflib terms,
+    and hands them to the sink as triples
+    """
+
+    from rdflib import BNode, Literal, URIRef
+    from rdflib.namespace import RDF, XSD
+
+    # rdflib keeps plain literals without a datatype
+    plain_datatypes = (str(XSD.string), str(RDF.langString))
+
+    def from_ox_term(term):
+        if isinstance(term, ox.NamedNode):
+            return URIRef(term.value)
+        if isinstance(term, ox.BlankNode):
+            return BNode(term.value)
+        if isinstance(term, ox.Literal):
+            if term.language is not None:
+                return Literal(term.value, lang=term.language)
+            datatype = term.datatype.value
+            if datatype in plain_datatypes:
+                return Literal(term.value)
+            return Literal(term.value, datatype=URIRef(datatype))
+        raise ValueError(f"Unsupported RDF term: {term}")
+
+    for quad in quads:
+        sink.triple(from_ox_term(quad.subject),
+                    from_ox_term(quad.predicate),
+                    from_ox_term(quad.object))
+
+def _xml_prefixes(input_file):
+    """
+    Returns the namespace prefixes declared up to and including the root element of an XML file,
+    because pyoxigraph does not report them for RDF/XML
+    """
+
+    prefixes = {}
+    for event, item in ET.iterparse(input_file, events=("start-ns", "start")):
+        if event == "start":
+            break
+        prefix, namespace = item
+        if prefix:
+            prefixes[prefix] = namespace
+    return prefixes
+
+def _ensure_plugins():
+    """
+    Registers the additional rdflib plugins, the first time it is called
+    """
+
+    global _PLUGINS_REGISTERED
+    if _PLUGINS_REGISTERED:
+        return
+
+    from rdflib import plugin
+    from rdflib.parser import Parser
+    from rdflib.serializer import Serializer
+
+    plugin.register("rdf-json", Parser    , "rdflib_rdfjson.rdfjson_parser"    , "RdfJsonParser")
+    plugin.register("rdf-json", Serializer, "rdflib_rdfjson.rdfjson_serializer", "RdfJsonSerializer")
+    _PLUGINS_REGISTERED = True
+
+def _load_graph(g, input_file, input_format):
+    """
+    Parses the input file into the graph, with pyoxigraph if it is installed
+    and supports the input format, with rdflib otherwise.
+    """
+
+    _ensure_plugins()
+    sink = _BatchSink(g)
+
+    if ox is None or input_format not in OXIGRAPH_INPUT_FORMATS:
+        if input_format in STREAMABLE_INPUT_FORMATS:
+            _parse_lines(input_file, input_format, sink)
+            sink.flush()
+        else:
+            g.parse(input_file, format=input_format)
+        return
+
+    quads = _ox_parse(input_file, input_format)
+    _add_ox_quads(quads, sink)
+    sink.flush()
+    # the prefixes are only known once the whole file was parsed
+    prefixes = quads.prefixes
+    if OXIGRAPH_INPUT_FORMATS[input_format] == "RDF_XML":
+        prefixes = _xml_prefixes(input_file)
+    for prefix, namespace in prefixes.items():
+        g.bind(prefix, namespace)
+
+def _cache_path(args, input_file):
+    """
+    Returns the path of the cached N-Triples serialization for the given input file,
+    keyed by a hash of its content, its absolute path and the input format
+    (relative IRIs are resolved against the location of the file,
+    so equal files in different places may have different graphs)
+    """
+
+    hasher = blake3.blake3() if blake3 is not None else hashlib.sha256()
+    with open(input_file, "rb") as in_stream:
+        for chunk in iter(functools.partial(in_stream.read, 1 << 20), b""):
+            hasher.update(chunk)
+    hasher.update(b"\0" + os.path.abspath(input_file).encode("utf-8"))
+    hasher.update(b"\0" + args.FROM.encode("utf-8"))
+    return os.path.join(CACHE_DIR, hasher.hexdigest() + ".nt")
+
+def _parse_cached(args, g, input_file):
+    """
+    Parses the input file into the graph, going through the cache if it is enabled.
+    The namespace bindings are cached next to the triples,
+    because N-Triples can not store them.
+    """
+
+    if not args.cache:
+        _load_graph(g, input_file, args.FROM)
+        return
+
+    from rdflib import Graph
+
+    # the cache entry must only contain this file,
+    # even if the graph already contains others (when merging)
+    file_graph = g if len(g) == 0 else Graph()
+
+    cache_file = _cache_path(args, input_file)
+    namespaces_file = os.path.splitext(cache_file)[0] + ".json"
+    if os.path.exists(cache_file) and os.path.exists(namespaces_file):
+        _load_graph(file_graph, cache_file, "nt")
+        with open(namespaces_file, encoding="utf-8") as in_stream:
+            for prefix, namespace in json.load(in_stream).items():
+                file_graph.bind(prefix, namespace, override=True, replace=True)
+    else:
+        _load_graph(file_graph, input_file, args.FROM)
+        os.makedirs(CACHE_DIR, exist_ok=True)
+        # write to temporary files first, so other workers never see half written cache entries
+        tmp_suffix = f".{os.getpid()}.tmp"
+        file_graph.serialize(cache_file + tmp_suffix, format="nt", encoding="utf-8")
+        with open(namespaces_file + tmp_suffix, "w", encoding="utf-8") as out:
+            json.dump({prefix: str(namespace) for prefix, namespace in file_graph.namespaces()},
+                      out)
+        os.replace(namespaces_file + tmp_suffix, namespaces_file)
+        os.replace(cache_file + tmp_suffix, cache_file)
+
+    if file_graph is not g:
+        g.addN((s, p, o, g) for s, p, o in file_graph)
+        for prefix, namespace in file_graph.namespaces():
+            g.bind(prefix, namespace)
+
+def _stdout_buffer():
+    """
+    Returns the binary stdout, after flushing everything written to the text stdout so far
+    """
+
+    sys.stdout.flush()
+    return sys.stdout.buffer
+
+def _copy_to_stdout(input_file):
+    """
+    Copies the file to the stdout,
+    with a zero-copy sendfile where the platform supports it
+    """
+
+    out = _stdout_buffer()
+    out.flush()
+    with open(input_file, "rb") as in_stream:
+        offset = 0
+        if hasattr(os, "sendfile"):
+            try:
+                size = os.fstat(in_stream.fileno()).st_size
+                while offset < size:
+                    sent = os.sendfile(out.fileno(), in_stream.fileno(), offset, size - offset)
+                    if sent == 0:
+                        break
+                    offset += sent
+                return
+            except io.UnsupportedOperation:
+                # the stdout was replaced by something without a file descriptor
+                pass
+            except OSError as error:
+                # sendfile is not supported for this kind of stdout
+                if error.errno not in (errno.EINVAL, errno.ENOSYS):
+                    raise
+            # fall back to copying the rest through a buffer
+            in_stream.seek(offset)
+        shutil.copyfileobj(in_stream, out, COPY_BUFFER_SIZE)
+
+@contextlib.contextmanager
+def _replacing(output_abs_file_name):
+    """
+    Yields the name of a temporary file next to the output file,
+    which only replaces the output file once it was written completely,
+    so a parse error half way through never leaves a partial output file behind
+    """
+
+    tmp_file = f"{output_abs_file_name}.{os.getpid()}.tmp"
+    try:
+        yield tmp_file
+    except BaseException:
+        with contextlib.suppress(FileNotFoundError):
+            os.remove(tmp_file)
+        raise
+    os.replace(tmp_file, output_abs_file_name)
+
+def _convert_one(args, job, may_copy=True):
+    """
+    Parses a single input file and serializes it into the output format.
+    This runs in a worker process, so it must never prompt the user.
+    If the output file is None, the output is streamed to the stdout.
+    may_copy has to be False if the output gets concatenated with other outputs,
+    because only parsing gives the blank nodes of each input file distinct labels.
+    """
+
+    input_file, output_abs_file_name = job
+
+    # no need to parse anything, if the input already is valid output
+    # (shutil.copyfile uses the zero-copy sendfile where the platform supports it)
+    if may_copy and (args.FROM, args.TO) in COPYABLE_FORMAT_PAIRS:
+        if output_abs_file_name is None:
+            _copy_to_stdout(input_file)
+        else:
+            shutil.copyfile(input_file, output_abs_file_name)
+        return
+
+    if args.FROM in STREAMABLE_INPUT_FORMATS and args.TO in STREAMABLE_OUTPUT_FORMATS:
+        if output_abs_file_name is None:
+            # independent of the locale, like all the other outputs
+            out = io.TextIOWrapper(_stdout_buffer(), encoding="utf-8")
+            try:
+                _stream_convert(args, input_file, out)
+                out.flush()
+            finally:
+                # keeps the stdout open for later outputs
+                out.detach()
+        else:
+            # parsing only happens while writing, so write to a temporary file first
+            with _replacing(output_abs_file_name) as tmp_file, \
+                    open(tmp_file, "w", encoding="utf-8") as out:
+                _stream_convert(args, input_file, out)
+        return
+
+    from rdflib import Graph
+
+    # no need for rdflib, if pyoxigraph can do both the parsing and the serializing
+    if (ox is not None and args.FROM in OXIGRAPH_INPUT_FORMATS
+            and args.TO in OXIGRAPH_OUTPUT_FORMATS):
+        output_format = getattr(ox.RdfFormat, OXIGRAPH_OUTPUT_FORMATS[args.TO])
+        quads = _ox_parse(input_file, args.FROM)
+        if output_abs_file_name is None:
+            ox.serialize(quads, _stdout_buffer(), format=output_format)
+        else:
+            # parsing only happens while writing, so write to a temporary file first
+            with _replacing(output_abs_file_name) as tmp_file:
+                ox.serialize(quads, tmp_file, format=output_format)
+        return
+
+    g = Graph()
+    _parse_cached(args, g, input_file)
+
+    if output_abs_file_name is None:
+        # stream it, instead of building the whole serialization as one string first
+        g.serialize(destination=_stdout_buffer(), format=args.TO, encoding="utf-8")
+    else:
+        g.serialize(output_abs_file_name, format=args.TO)
+
+def _prefetch(input_file):
+    """
+    Reads the whole input file and throws the content away,
+    so the parsing process later finds it in the page cache
+    """
+
+    buffer = bytearray(1 << 20)
+    with open(input_file, "rb", buffering=0) as in_stream:
+        while in_stream.readinto(buffer):
+            pass
+
+def _convert_pipelined(convert, jobs, max_workers):
+    """
+    Yields the results of converting the jobs, in the same order as the jobs.
+    A thread pool reads the input files ahead, while a process pool parses
+    the files that were already read, so the disk I/O overlaps with the parsing.
+    At most twice as many files as workers are in flight at once.
+    """
+
+    depth = 2 * max_workers
+    with ThreadPoolExecutor(max_workers=PREFETCH_THREADS) as readers, \
+            ProcessPoolExecutor(max_workers=max_workers) as workers:
+
+        reads = collections.deque()
+        conversions = collections.deque()
+
+        # the conversions are only ever submitted from this thread,
+        # because forking the worker processes from a reader thread could deadlock
+        def submit_oldest_read():
+            job, read = reads.popleft()
+            read.result()
+            conversions.append(workers.submit(convert, job))
+
+        for index, job in enumerate(jobs):
+            if index == 0:
+                # there is nothing to overlap the first file with; submitting it directly
+                # also starts the worker processes before any reader thread exists
+                conversions.append(workers.submit(convert, job))
+                continue
+            while len(reads) + len(conversions) >= depth:
+                if reads and len(conversions) < max_workers:
+                    submit_oldest_read()
                 else:
-                    g.serialize(output_abs_file_name, format=args.TO)
-                    verbose(f" - file '{output_abs_file_name}' has been written")
+                    yield conversions.popleft().result()
+            reads.append((job, readers.submit(_prefetch, job[0])))
+            while reads and reads[0][1].done():
+                submit_oldest_read()
+
+        while reads:
+            submit_oldest_read()
+        while conversions:
+            yield conversions.popleft().result()
+
+def _report(args, job):
+    input_file, output_abs_file_name = job
+    if args.simulate:
+        if output_abs_file_name is None:
+            print(f"Simulation: this file would be converted to the stdout: {input_file}")
+        else:
+            print(f"Simulation: this file would be written: {output_abs_file_name}")
+    elif output_abs_file_name is None:
+        log.debug(" - '%s' has been written to the stdout", input_file)
+    else:
+        log.debug(" - file '%s' has been written", output_abs_file_name)
+
+def process_input_files(args, jobs):
+    """
+    Converts the input files, in parallel if more than one job is requested
+    """
+
+    # when simulating, there is no need to even parse the input files
+    if args.simulate:
+        for job in jobs:
+            _report(args, job)
+        return
+
+    # the outputs of several jobs all end up in the stdout
+    may_copy = args.OUTPUTDIR is not None or len(jobs) <= 1
+
+    if args.jobs <= 1 or len(jobs) <= 1:
+        for job in jobs:
+            _convert_one(args, job, may_copy)
+            _report(args, job)
+        return
+
+    if args.OUTPUTDIR is not None:
+        convert = functools.partial(_convert_one, args)
+        # results come in the same order as the jobs were given
+        for job, _ in zip(jobs, _convert_pipelined(convert, jobs, args.jobs)):
+            _report(args, job)
+        return
+
+    # the worker processes can not share the stdout,
+    # so they write to temporary files, which are then copied to the stdout in order
+    convert = functools.partial(_convert_one, args, may_copy=False)
+    with tempfile.TemporaryDirectory(prefix="rdfconvert-") as tmp_dir:
+        tmp_jobs = [(input_file, os.path.join(tmp_dir, str(index)))
+                    for index, (input_file, _) in enumerate(jobs)]
+        for job, (_, tmp_file), _ in zip(jobs, tmp_jobs,
+                                         _convert_pipelined(convert, tmp_jobs, args.jobs)):
+            _copy_to_stdout(tmp_file)
+            os.remove(tmp_file)
+            _report(args, job)
+
+def merge_input_files(args, output_dir_abs, output_extension, input_files, input_abs_files):
+    """
+    Parses all the input files into a single graph, and serializes it once
+    """
+
+    if output_dir_abs is None:
+        output_abs_file_name = None
+    else:
+        output_abs_file_name = os.path.join(output_dir_abs, args.merge_name + output_extension)
+        log.debug(" - merged output filename: '%s'", output_abs_file_name)
+        # for safety, check that we're not overwriting one of the input files
+        if output_abs_file_name in input_abs_files:
+            sys.exit(f"ERROR: Input file '{output_abs_file_name}' is the same as output file!")
+        if not may_write(args, output_abs_file_name):
+            log.debug(" - the merged file will be skipped")
+            return
+
+    if args.simulate:
+        for input_file in input_files:
+            print(f"Simulation: this file would be merged: {input_file}")
+        if output_abs_file_name is None:
+            print("Simulation: the merged graph would be written to the stdout")
+        else:
+            print(f"Simulation: this file would be written: {output_abs_file_name}")
+        return
+
+    from rdflib import Graph
+
+    g = Graph()
+    for input_file in input_files:
+        _parse_cached(args, g, input_file)
+        log.debug(" - the graph of '%s' was merged", input_file)
+
+    if output_abs_file_name is None:
+        g.serialize(destination=_stdout_buffer(), format=args.TO, encoding="utf-8")
+        log.debug(" - the merged graph has been written to the stdout")
+    else:
+        g.serialize(output_abs_file_name, format=args.TO, encoding="utf-8")
+        log.debug(" - file '%s' has been written", output_abs_file_name)
 
 def main():
     args = parse_args()
 
-    # a simple function to log verbose info
-    def verbose(msg):
-        if args.verbose:
-            print(msg)
+    logging.basicConfig(level=logging.DEBUG if args.verbose else logging.WARNING,
+                        format="%(message)s")
 
-    verbose(f" - Input format: {args.FROM}")
-    verbose(f" - Output format: {args.TO}")
+    log.debug(" - Input format: %s", args.FROM)
+    log.debug(" - Output format: %s", args.TO)
 
     # find out which extensions we should match
     if args.FROM_EXT:
         input_extensions = args.FROM_EXT
     else:
         input_extensions = INPUT_FORMAT_TO_EXTENSIONS[args.FROM]
+    # build the matcher once for all input directories, without duplicate extensions
+    input_extensions = tuple(dict.fromkeys(input_extensions))
 
-    verbose(f" - Input extensions: {input_extensions}")
+    log.debug(" - Input extensions: %s", input_extensions)
 
     # find out which output extension we should write
     if args.TO_EXT:
@@ -287,42 +982,78 @@ def main():
     else:
         output_extension = OUTPUT_FORMAT_TO_EXTENSION[args.TO]
 
-    verbose(f" - Output extension: '{output_extension}'")
+    log.debug(" - Output extension: '%s'", output_extension)
 
-    # process each input file sequentially:
+    if args.OUTPUTDIR is None:
+        output_dir_abs = None
+    else:
+        output_dir_abs = os.path.abspath(args.OUTPUTDIR)
+        # if an output directory was provided, but it doesn't exist, then exit the script
+        if not os.path.isdir(output_dir_abs):
+            sys.exit(f"ERROR: Output dir '{args.OUTPUTDIR}' was not found!")
+
+    # first collect all the files to convert, then convert them all at once
+    jobs = []
+    planned_outputs = {}
+    merged_input_files = []
+    # the absolute paths of all input files found so far, so each one is only converted once,
+    # even if it is given multiple times or found in overlapping input directories
+    seen_input_files = set()
     for input_file_or_dir in args.INPUT:
 
-        verbose(f"Now processing input file or directory '{input_file_or_dir}'")
+        log.debug("Now processing input file or directory '%s'", input_file_or_dir)
 
         # check if the file exists, and if it's a directory or a file
-        is_dir = False
-        if os.path.exists(input_file_or_dir):
-            if os.path.isdir(input_file_or_dir):
-                verbose(f" - '{input_file_or_dir}' exists and is a directory")
-                input_file_or_dir = os.path.abspath(input_file_or_dir)
-                is_dir = True
-            else:
-                verbose(f" - '{input_file_or_dir}' exists and is a file")
-        else:
+        # (with a single stat call)
+        try:
+            input_stat = os.stat(input_file_or_dir)
+        except FileNotFoundError:
             sys.exit(f"ERROR: Input file '{input_file_or_dir}' was not found!")
+        except OSError as error:
+            sys.exit(f"ERROR: Input file '{input_file_or_dir}' can not be accessed: {error.strerror}")
+        is_dir = stat.S_ISDIR(input_stat.st_mode)
+        if is_dir:
+            log.debug(" - '%s' exists and is a directory", input_file_or_dir)
+            input_file_or_dir = os.path.abspath(input_file_or_dir)
+        else:
+            log.debug(" - '%s' exists and is a file", input_file_or_dir)
 
         input_files = []
 
         if is_dir:
-            verbose(f" - Now walking the directory (recursive = {args.recursive}):")
-            for root, dirnames, filenames in os.walk(input_file_or_dir):
-                verbose(f"   * Finding files in '{root}'")
-                for extension in input_extensions:
-                    for filename in fnmatch.filter(filenames, f"*{extension}"):
-                        verbose(f"     -> found '{filename}'")
-                        input_files.append(os.path.join(root, filename))
-                if not args.recursive:
-                    break
+            log.debug(" - Now walking the directory (recursive = %s):", args.recursive)
+            for input_file in _iter_input_files(input_file_or_dir, input_extensions,
+                                                args.recursive):
+                if input_file in seen_input_files:
+                    log.debug("     -> skipping '%s', it was found already", input_file)
+                    continue
+                log.debug("     -> found '%s'", input_file)
+                seen_input_files.add(input_file)
+                input_files.append(input_file)
 
         else:
-            input_files.append(input_file_or_dir)
+            input_abs_file_name = os.path.abspath(input_file_or_dir)
+            if input_abs_file_name in seen_input_files:
+                log.debug(" - skipping '%s', it was found already", input_file_or_dir)
+            else:
+                seen_input_files.add(input_abs_file_name)
+                input_files.append(input_file_or_dir)
+
+        if args.merge:
+            merged_input_files.extend(input_files)
+        else:
+            plan_output_files(args, output_dir_abs, input_file_or_dir, output_extension,
+                              input_files, jobs, planned_outputs)
+
+    if args.merge:
+        merge_input_files(args, output_dir_abs, output_extension, merged_input_files,
+                          seen_input_files)
+        return
 
-        process_input_files(verbose, args, input_file_or_dir, output_extension, input_files)
+    # drop the jobs whose output gets overwritten by a later one anyway
+    jobs = [job for job in jobs if job is not None]
+    create_output_dirs(args, jobs)
+    process_input_files(args, jobs)
 
 if __name__ == "__main__":
     main()